@@ -1,32 +1,125 @@
 from __future__ import annotations
 
 import argparse
+import functools
+import gzip
+import hashlib
+import json
 import logging
 import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import requests
+import cmarkgfm
+import nh3
+from cmarkgfm.cmark import Options
+
+if TYPE_CHECKING:
+    import requests
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+GZIP_MIN_SIZE = 1024
+# Set once the API rejects a compressed request body.
+_gzip_rejected = False
+MAX_WORKERS = 8
+# Shared HTTP session, created on first use by `http_session`.
+_session = None
+_session_lock = threading.Lock()
+
+# Assets are read once at import and shared by every converter.
+ASSET_DIR = Path(os.path.dirname(__file__), "assets")
+_TEMPLATE = Path(ASSET_DIR, "template.html").read_text(encoding="utf-8")
+_CSS = {
+    file.stem: file.read_text(encoding="utf-8")
+    for file in sorted(ASSET_DIR.iterdir())
+    if file.suffix == ".css"
+}
+THEMES = tuple(_CSS)
+# Identifies the template and CSS each theme's output was rendered with.
+_ASSET_DIGESTS = {
+    theme: hashlib.sha256((_TEMPLATE + css).encode("utf-8")).hexdigest()
+    for theme, css in _CSS.items()
+}
+_TAG_PATTERN = re.compile(r"(\{% (?:STYLE|THEME|CONTENT) %\})")
+# Encoded template text alternating with the tags that separate it.
+_TEMPLATE_PARTS = [part.encode("utf-8") for part in _TAG_PATTERN.split(_TEMPLATE)]
+
+# HTML allowed through local renders, on top of nh3's defaults: task list
+# checkboxes, footnotes, code block languages and alignment.
+_ALLOWED_TAGS = nh3.ALLOWED_TAGS | {"input", "section", "tfoot"}
+_EXTRA_ATTRIBUTES = {
+    "a": {
+        "id",
+        "class",
+        "title",
+        "aria-label",
+        "data-footnote-ref",
+        "data-footnote-backref",
+        "data-footnote-backref-idx",
+    },
+    "code": {"class"},
+    "details": {"open"},
+    "div": {"align"},
+    "h1": {"align"},
+    "h2": {"align"},
+    "h3": {"align"},
+    "h4": {"align"},
+    "h5": {"align"},
+    "h6": {"align"},
+    "img": {"title"},
+    "input": {"type", "checked", "disabled"},
+    "li": {"id"},
+    "p": {"align"},
+    "pre": {"lang"},
+    "section": {"class", "data-footnotes"},
+    "sup": {"class"},
+}
+_ALLOWED_ATTRIBUTES = {
+    tag: set(nh3.ALLOWED_ATTRIBUTES.get(tag, ())) | _EXTRA_ATTRIBUTES.get(tag, set())
+    for tag in nh3.ALLOWED_ATTRIBUTES.keys() | _EXTRA_ATTRIBUTES.keys()
+}
+
+_FRONT_MATTER_PATTERN = re.compile(
+    r"\A---\r?\n(\S[\s\S]*?)\r?\n---[ \t]*(?:\r?\n|\Z)",
+)
+
 
 class MarkdownToHTML:
     """Convert Markdown to HTML with GitHub styling."""
 
     encoding = "utf-8"
-    asset_dir = Path(os.path.dirname(__file__), "assets")
-    themes = [
-        Path(file).stem for file in os.listdir(asset_dir) if file != "template.html"
-    ]
+    asset_dir = ASSET_DIR
+    themes = THEMES
+    _theme_wrappers = {
+        theme: f"""<div
+            class="github-markdown-body"
+            data-color-mode="{theme}"
+            data-dark-theme="{theme}"
+            data-light-theme="{theme}">
+        """.encode()
+        for theme in themes
+    }
+    _styles = {theme: f"<style>{css}</style>".encode() for theme, css in _CSS.items()}
 
-    def __init__(self: MarkdownToHTML, markdown_file: str, theme: str = "dark") -> None:
+    def __init__(
+        self: MarkdownToHTML,
+        markdown_file: str,
+        theme: str = "dark",
+        online: bool = False,
+    ) -> None:
         """Convert Markdown to HTML with GitHub styling.
 
         Args:
         ----
             markdown_file (str): Markdown file to convert.
             theme (str): Theme for the output HTML (dark, light).
+            online (bool): Render with the GitHub API instead of locally.
         """
         self.markdown_file = Path(markdown_file)
         if not self.markdown_file.is_file():
@@ -34,20 +127,19 @@ class MarkdownToHTML:
         if theme not in self.themes:
             raise ValueError("Theme not in list of valid options: ", self.theme)
         self.markdown = self.read(self.markdown_file)
+        self.parse_markdown()
         self.theme = theme
-        self.template_file = Path(self.asset_dir, "template.html")
-        self.template = self.read(self.template_file)
-        self.css_file = Path(self.asset_dir, f"{theme}.css")
-        self.css = self.read(self.css_file)
+        self.online = online
         self.html_file = Path(
             self.markdown_file.parent,
             f"{self.markdown_file.stem}.html",
         )
+        self.digest_file = Path(self.html_file.parent, f"{self.html_file.name}.sha256")
         self.html = None
 
     def __repr__(self: MarkdownToHTML) -> str:
         """MarkdownToHTML instance representation."""
-        return f"{self.__class__.__name__}(markdown_file={self.markdown_file}, theme={self.theme})"  # noqa
+        return f"{self.__class__.__name__}(markdown_file={self.markdown_file}, theme={self.theme}, online={self.online})"  # noqa
 
     def read(self: MarkdownToHTML, file: Path) -> str:
         """Read a file and return it's contents.
@@ -69,58 +161,371 @@ class MarkdownToHTML:
             logger.exception(err)
             raise err
 
+    def parse_markdown(self: MarkdownToHTML) -> MarkdownToHTML:
+        """Strip YAML front matter from the start of the Markdown.
+
+        A leading block between `---` lines is only treated as front matter when
+        it parses as a YAML mapping, so a document that opens with a thematic
+        break is left intact.
+        """
+        if not self.markdown.startswith(("---\n", "---\r\n")):
+            return self
+        match = _FRONT_MATTER_PATTERN.match(self.markdown)
+        if match and is_yaml_mapping(match.group(1)):
+            self.markdown = self.markdown[match.end() :]
+        return self
+
     def markdown_to_html(self: MarkdownToHTML) -> MarkdownToHTML:
-        """Convert Markdown to HTML using the GitHub API."""
-        self.html = send_request(
-            method="POST",
-            url="https://api.github.com/markdown",
-            json={
-                "mode": "markdown",
-                "text": self.markdown,
-            },
-            headers={
-                "Content-Type": "application/json",
-            },
-        ).text
+        """Convert Markdown to HTML.
+
+        GitHub Flavored Markdown is rendered locally with cmark-gfm unless
+        `online` is set, in which case the GitHub API is used instead. Local
+        renders keep raw HTML from an allowlist, similar to GitHub's, and drop
+        everything else, including scripts, event handlers and `javascript:`
+        URLs.
+        """
+        if not self.online:
+            self.html = nh3.clean(
+                cmarkgfm.github_flavored_markdown_to_html(
+                    self.markdown,
+                    options=Options.CMARK_OPT_UNSAFE | Options.CMARK_OPT_FOOTNOTES,
+                ),
+                tags=_ALLOWED_TAGS,
+                attributes=_ALLOWED_ATTRIBUTES,
+                link_rel=None,
+            )
+            return self
+        self.html = github_markdown_to_html(self.markdown)
         return self
 
-    def render(self: MarkdownToHTML) -> MarkdownToHTML:
-        """Render the Markdown as HTML."""
+    @property
+    def digest(self: MarkdownToHTML) -> str:
+        """SHA-256 of the Markdown, the options and the assets it is rendered with."""
+        source = "\0".join(
+            (self.theme, _ASSET_DIGESTS[self.theme], str(self.online), self.markdown),
+        )
+        return hashlib.sha256(source.encode(self.encoding)).hexdigest()
+
+    def is_up_to_date(self: MarkdownToHTML) -> bool:
+        """Check whether the HTML file is current with the Markdown.
+
+        The HTML file is current when it is newer than the Markdown file and the
+        digest recorded alongside it matches the Markdown being rendered.
+        """
+        try:
+            if self.html_file.stat().st_mtime < self.markdown_file.stat().st_mtime:
+                return False
+            return self.digest_file.read_text(encoding=self.encoding) == self.digest
+        except OSError:
+            return False
+
+    def render(self: MarkdownToHTML, force: bool = False) -> MarkdownToHTML:
+        """Render the Markdown as HTML.
+
+        Args:
+        ----
+            force (bool): Render even if the HTML file is already up to date.
+        """
+        if not force and self.is_up_to_date():
+            logger.info(f"Up to date: {self.markdown_file} -> {self.html_file}")
+            return self
         if not self.html:
             self.markdown_to_html()
         update_tags = {
-            "{% STYLE %}": f"<style>{self.css}</style>",
-            "{% THEME %}": f"""<div
-            class="github-markdown-body"
-            data-color-mode="{self.theme}"
-            data-dark-theme="{self.theme}"
-            data-light-theme="{self.theme}">
-        """,
-            "{% CONTENT %}": self.html,
+            b"{% STYLE %}": self._styles[self.theme],
+            b"{% THEME %}": self._theme_wrappers[self.theme],
+            b"{% CONTENT %}": self.html.encode(self.encoding),
         }
-        for key, value in update_tags.items():
-            self.template = self.template.replace(key, value)
-        with open(self.html_file, "w", encoding=self.encoding) as f:
-            f.write(self.template)
+        with open(self.html_file, "wb") as f:
+            for i, part in enumerate(_TEMPLATE_PARTS):
+                f.write(update_tags[part] if i % 2 else part)
+        self.digest_file.write_text(self.digest, encoding=self.encoding)
         logger.info(f"Complete: {self.markdown_file} -> {self.html_file}")
         return self
 
 
-def send_request(method: str, url: str, **kwargs) -> requests.Response:  # noqa
+def is_yaml_mapping(text: str) -> bool:
+    """Check whether text parses as a YAML mapping.
+
+    The text is only composed into a node tree, so values such as invalid
+    dates are never constructed and cannot raise.
+
+    Args:
+    ----
+        text (str): Text to parse.
+
+    Returns:
+    -------
+        bool: True if the text is a YAML mapping.
+    """
+    import yaml
+
+    try:
+        node = yaml.compose(text, Loader=yaml.SafeLoader)
+    except (yaml.YAMLError, ValueError, RecursionError):
+        return False
+    return isinstance(node, yaml.MappingNode)
+
+
+def render_batch(
+    markdown_files: list[str],
+    theme: str = "dark",
+    online: bool = False,
+    force: bool = False,
+) -> list[MarkdownToHTML]:
+    """Render several Markdown files as HTML.
+
+    Files are rendered and written concurrently by up to `MAX_WORKERS` threads.
+    Files whose HTML is already up to date are skipped unless `force` is set.
+    Each output file is written at most once, so repeated paths and files that
+    map to the same output are only rendered for their first occurrence.
+
+    Args:
+    ----
+        markdown_files (list[str]): Markdown files to convert.
+        theme (str): Theme for the output HTML (dark, light).
+        online (bool): Render with the GitHub API instead of locally.
+        force (bool): Render files even if their HTML is up to date.
+
+    Returns:
+    -------
+        list[MarkdownToHTML]: One converter per output file, in input order.
+    """
+    converters = {}
+    for file in markdown_files:
+        converter = MarkdownToHTML(markdown_file=file, theme=theme, online=online)
+        output = converter.html_file.resolve()
+        if output not in converters:
+            converters[output] = converter
+        elif converters[output].markdown_file.resolve() != (
+            converter.markdown_file.resolve()
+        ):
+            logger.warning(
+                f"Skipping {converter.markdown_file}: {converter.html_file} is "
+                f"already rendered from {converters[output].markdown_file}",
+            )
+    pending = []
+    for converter in converters.values():
+        if force or not converter.is_up_to_date():
+            pending.append(converter)
+        else:
+            logger.info(
+                f"Up to date: {converter.markdown_file} -> {converter.html_file}",
+            )
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(converter.render, force=True) for converter in pending
+        ]
+        for future in as_completed(futures):
+            future.result()
+    return list(converters.values())
+
+
+@functools.lru_cache(maxsize=128)
+def github_markdown_to_html(markdown: str) -> str:
+    """Convert Markdown to HTML using the GitHub API.
+
+    Results are cached on disk and in memory so unchanged Markdown is only
+    sent to the API once.
+
+    Args:
+    ----
+        markdown (str): Markdown document to convert.
+
+    Returns:
+    -------
+        str: Rendered HTML.
+    """
+    html = read_cache(markdown)
+    if html is None:
+        html = post_markdown(markdown)
+        write_cache(markdown, html)
+    return html
+
+
+def post_markdown(text: str) -> str:
+    """Send Markdown to the GitHub API and return the rendered HTML.
+
+    Request bodies larger than `GZIP_MIN_SIZE` bytes are gzip-compressed. If the
+    API rejects the compressed body, it is sent again uncompressed and later
+    requests are no longer compressed.
+
+    Args:
+    ----
+        text (str): Markdown to render.
+
+    Returns:
+    -------
+        str: Rendered HTML.
+    """
+    global _gzip_rejected
+
+    body = json.dumps({"mode": "markdown", "text": text}).encode(
+        MarkdownToHTML.encoding,
+    )
+    headers = {
+        "Content-Type": "application/json",
+        "Accept-Encoding": "gzip",
+    }
+    if len(body) > GZIP_MIN_SIZE and not _gzip_rejected:
+        response = send_request(
+            method="POST",
+            url="https://api.github.com/markdown",
+            allowed_status=(400, 415),
+            data=gzip.compress(body),
+            headers={**headers, "Content-Encoding": "gzip"},
+        )
+        if response.ok:
+            return response.text
+        _gzip_rejected = True
+        logger.info("Compressed request rejected, sending requests uncompressed.")
+    return send_request(
+        method="POST",
+        url="https://api.github.com/markdown",
+        data=body,
+        headers=headers,
+    ).text
+
+
+def cache_dir() -> Path:
+    """Return the directory GitHub API output is cached in.
+
+    This is `markdown-to-html` under `$XDG_CACHE_HOME`, or under `~/.cache` when
+    that variable is unset or empty.
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base, "markdown-to-html")
+
+
+def cache_file(markdown: str) -> Path:
+    """Return the cache file for a Markdown document.
+
+    Args:
+    ----
+        markdown (str): Markdown document.
+
+    Returns:
+    -------
+        Path: Cache file path, keyed by the SHA-256 of the Markdown.
+    """
+    key = hashlib.sha256(markdown.encode(MarkdownToHTML.encoding)).hexdigest()
+    return Path(cache_dir(), f"{key}.html")
+
+
+def read_cache(markdown: str) -> str | None:
+    """Return cached HTML for a Markdown document, if any.
+
+    Args:
+    ----
+        markdown (str): Markdown document.
+
+    Returns:
+    -------
+        str | None: Cached HTML, or None on a cache miss.
+    """
+    try:
+        return cache_file(markdown).read_text(encoding=MarkdownToHTML.encoding)
+    except (OSError, RuntimeError):
+        return None
+
+
+def write_cache(markdown: str, html: str) -> None:
+    """Atomically store the HTML rendered for a Markdown document.
+
+    Failing to write the cache is logged and otherwise ignored.
+
+    Args:
+    ----
+        markdown (str): Markdown document.
+        html (str): Rendered HTML.
+    """
+    tmp = None
+    try:
+        file = cache_file(markdown)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=file.parent, suffix=".tmp")
+        with open(fd, "w", encoding=MarkdownToHTML.encoding) as f:
+            f.write(html)
+        os.replace(tmp, file)
+    except (OSError, RuntimeError) as err:
+        logger.warning(f"Unable to cache rendered HTML: {err}")
+        if tmp is not None:
+            Path(tmp).unlink(missing_ok=True)
+
+
+def http_session() -> requests.Session:
+    """Return the shared HTTP session, creating it on first use.
+
+    The session keeps connections to the API alive between requests and
+    retries throttled or failed requests with backoff. Its pool holds one
+    connection per worker thread and makes extra threads wait for a free
+    connection instead of opening throwaway ones. Requests are
+    authenticated with the `GITHUB_TOKEN` environment variable when it is set.
+    Creation is locked so concurrent workers share a single session.
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            retry = Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=[429, 502, 503, 504],
+                allowed_methods=["GET", "POST"],
+                raise_on_status=False,
+            )
+            session = requests.Session()
+            # HTTP/1.1 keep-alive with one pooled connection per worker; the
+            # handful of connections this opens costs one TLS handshake each
+            # per run, which HTTP/2 multiplexing would not meaningfully reduce.
+            session.mount(
+                "https://",
+                HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=MAX_WORKERS,
+                    pool_block=True,
+                    max_retries=retry,
+                ),
+            )
+            session.headers["Connection"] = "keep-alive"
+            token = os.environ.get("GITHUB_TOKEN")
+            if token:
+                session.headers["Authorization"] = f"Bearer {token}"
+            _session = session
+    return _session
+
+
+def send_request(
+    method: str,
+    url: str,
+    allowed_status: tuple[int, ...] = (),
+    **kwargs,  # noqa
+) -> requests.Response:
     """Send an HTTP request.
 
+    Requests are sent through the shared session returned by `http_session`.
+
     Args:
     ----
         method (str): Request method to use (GET, POST, DELETE).
         url (str): URL to send request.
+        allowed_status (tuple[int, ...]): Error status codes to return to the
+            caller instead of raising.
 
     Returns:
     -------
         requests.Response: Request response.
     """
+    import requests
+
     try:
-        response = requests.request(method=method, url=url, **kwargs)
-        response.raise_for_status()
+        response = http_session().request(method=method, url=url, **kwargs)
+        if response.status_code not in allowed_status:
+            response.raise_for_status()
         return response
     except requests.exceptions.RequestException as err:
         logger.exception(err)
@@ -139,7 +544,8 @@ def clparser() -> argparse.ArgumentParser:
     parser.add_argument(
         "markdown_file",
         type=str,
-        help="Markdown file to render as HTML.",
+        nargs="+",
+        help="Markdown file(s) to render as HTML.",
     )
     parser.add_argument(
         "-t",
@@ -148,6 +554,21 @@ def clparser() -> argparse.ArgumentParser:
         default="dark",
         help=f"Theme for rendering HTML. Valid themes: {MarkdownToHTML.themes}",
     )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Render files even if their HTML is up to date.",
+    )
+    parser.add_argument(
+        "-o",
+        "--online",
+        action="store_true",
+        help=(
+            "Render with the GitHub API instead of locally. Local renders keep "
+            "an allowlist of raw HTML similar to, but not identical to, GitHub's."
+        ),
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -161,4 +582,9 @@ if __name__ == "__main__":
     args = clparser().parse_args()
     if args.verbose:
         logger.addHandler(logging.StreamHandler())
-    MarkdownToHTML(markdown_file=args.markdown_file, theme=args.theme).render()
+    render_batch(
+        markdown_files=args.markdown_file,
+        theme=args.theme,
+        online=args.online,
+        force=args.force,
+    )